@@ -0,0 +1,13 @@
+import multiprocessing
+import os
+
+# Loopback only: the app sits behind deploy/nginx.conf, and with TRUSTED_PROXY_COUNT set
+# a client reaching the port directly could choose its own X-Forwarded-For address.
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:3000")
+# The API endpoints spend nearly all their time waiting on OpenAI, so each
+# worker runs a pool of threads to keep many upstream calls in flight at once.
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+keepalive = 5
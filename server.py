@@ -1,26 +1,70 @@
 import os
-from flask import Flask, request, jsonify, send_file, send_from_directory, Response
+import functools
+import gzip
+import hashlib
+import re
+import time
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from flask import Flask, g, request, jsonify, send_from_directory, Response
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from pydantic import BaseModel, Field, ValidationError, model_validator
+from typing import List, Literal
 import logging
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-import base64
+from werkzeug.middleware.proxy_fix import ProxyFix
 import secrets
 
 load_dotenv()
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(APP_DIR)
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
-IMAGES_DIR = os.path.join(os.path.dirname(__file__), 'images')
-CSS_DIR = os.path.join(os.path.dirname(__file__), 'css')
+IMAGES_DIR = os.path.join(APP_DIR, 'images')
+CSS_DIR = os.path.join(APP_DIR, 'css')
+INDEX_HTML_PATH = os.path.join(APP_DIR, 'index.html')
+LOGO_PATH = os.path.join(IMAGES_DIR, 'logo.png')
 
+# Number of reverse proxies in front of the app (1 behind deploy/nginx.conf). Only that
+# many X-Forwarded-For hops are trusted, so clients cannot spoof their rate-limit key.
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+
+def _client_key():
+    if 'client_key' not in g:
+        g.client_key = request.remote_addr or '127.0.0.1'
+    return g.client_key
+
+# Point RATELIMIT_STORAGE_URI at Redis (e.g. redis://localhost:6379/0) in production so
+# every worker shares one set of counters; the in-memory default is per-process.
 limiter = Limiter(
-    get_remote_address,
+    _client_key,
     app=None,
+    storage_uri=os.getenv("RATELIMIT_STORAGE_URI", "memory://"),
+    strategy="moving-window",
     default_limits=["100 per hour"]
 )
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Routes jsonify() and request.get_json() through orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype=self.mimetype)
+
 app = Flask(__name__, static_folder=STATIC_DIR, static_url_path='/static')
+app.json = OrjsonProvider(app)
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
 app.config['CSRF_COOKIE_SECURE'] = os.getenv('CSRF_COOKIE_SECURE', 'false').lower() == 'true'
 CSRF_COOKIE_NAME = 'csrf-token'
 
@@ -53,25 +97,141 @@ def verify_csrf():
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo") 
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_TIMEOUT = (3.05, 30)
+OPENAI_RETRIES = 3
+OPENAI_BACKOFF = 0.2
+OPENAI_HEADERS = {
+    "Authorization": f"Bearer {OPENAI_API_KEY}",
+    "Content-Type": "application/json"
+}
+BASE_PAYLOAD = {"model": OPENAI_MODEL, "temperature": 0.0}
+
+# Prompt text is built once at import; only the career/area is filled in per request.
+AREAS_SYSTEM_TMPL = (
+    "You are an expert career coach. "
+    "List ONLY the main interview/practice areas for the career: '{coach}'. "
+    "Return a valid JSON array with 10 to 30 distinct strings covering the breadth of the role. "
+    "No commentary, no explanation, no markdown, no keys, no extra text."
+)
+AREAS_USER_TMPL = (
+    "Provide 10-30 core interview/practice areas for a '{coach}' candidate. "
+    "Output ONLY a JSON array of strings."
+)
+CHECK_AREA_SYSTEM_MESSAGE = {"role": "system", "content": (
+    "You are a strict career safety classifier. "
+    "Only allow mainstream, legal, and ethical career areas suitable for professional coaching. "
+    "If the area is unsafe, illegal, unethical, or inappropriate (e.g., suicide, sex work, criminal activity), respond ONLY with JSON: {\"safe\": false, \"reason\": \"<short reason>\"}. "
+    "If the area is safe and appropriate for coaching, respond ONLY with JSON: {\"safe\": true}. "
+    "No commentary, no extra text, no markdown."
+)}
+CHECK_AREA_USER_TMPL = "Is the area '{area}' safe and appropriate for career coaching?"
+
+# One pooled session so OpenAI calls reuse keep-alive connections instead of
+# paying a TCP + TLS handshake per request. The pool holds one socket per gunicorn
+# thread, so no thread ever opens a throwaway connection.
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", os.getenv("GUNICORN_THREADS", "16")))
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=OPENAI_POOL_SIZE,
+    max_retries=Retry(
+        total=OPENAI_RETRIES,
+        read=0,
+        backoff_factor=OPENAI_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"POST"})
+    )
+))
+
+class CircuitBreakerOpen(Exception):
+    """Raised instead of calling OpenAI while the breaker is open."""
+
+class CircuitBreaker:
+    """Fails fast after fail_max consecutive errors, then lets one trial call through
+    every reset_timeout seconds. The lock only guards the counters, never the call itself."""
+
+    def __init__(self, fail_max, reset_timeout):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._opened_at is not None:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitBreakerOpen()
+                # Half-open: this caller is the trial; everyone else keeps failing fast.
+                self._opened_at = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._failures += 1
+                if self._failures >= self.fail_max:
+                    self._opened_at = time.monotonic()
+            raise
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+        return result
+
+# Trips after consecutive transport failures (timeouts, exhausted retries) so a struggling
+# upstream gets fast 503s instead of every worker thread piling up behind it.
+OPENAI_BREAKER = CircuitBreaker(fail_max=5, reset_timeout=30)
+
+def _openai_post(payload, stream=False):
+    return OPENAI_BREAKER.call(
+        SESSION.post, OPENAI_URL, headers=OPENAI_HEADERS, data=orjson.dumps(payload),
+        timeout=OPENAI_TIMEOUT, stream=stream
+    )
+
+def _relay_stream(resp):
+    try:
+        for chunk in resp.iter_content(chunk_size=None):
+            yield chunk
+    finally:
+        resp.close()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-logo_path = os.path.join(IMAGES_DIR, 'logo.png')
-if not os.path.exists(logo_path):
-    logger.warning("Expected logo not found at %s", logo_path)
+FAVICON_BYTES = None
+if os.path.exists(LOGO_PATH):
+    with open(LOGO_PATH, 'rb') as f:
+        FAVICON_BYTES = f.read()
+else:
+    logger.warning("Expected logo not found at %s", LOGO_PATH)
+
+with open(INDEX_HTML_PATH, 'rb') as f:
+    INDEX_HTML_BYTES = f.read()
+INDEX_HTML_MTIME = os.path.getmtime(INDEX_HTML_PATH)
+INDEX_HTML_ETAG = hashlib.sha1(INDEX_HTML_BYTES).hexdigest()
+INDEX_HTML_GZ = gzip.compress(INDEX_HTML_BYTES, 9)
 
-FAVICON_BYTES = base64.b64decode('iVBORw0KGgo=')
+def _index_response():
+    if request.accept_encodings['gzip']:
+        resp = Response(INDEX_HTML_GZ, mimetype='text/html')
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.set_etag(INDEX_HTML_ETAG + '-gz')
+    else:
+        resp = Response(INDEX_HTML_BYTES, mimetype='text/html')
+        resp.set_etag(INDEX_HTML_ETAG)
+    resp.vary.add('Accept-Encoding')
+    resp.last_modified = INDEX_HTML_MTIME
+    # private: the response carries the per-visitor CSRF cookie, so shared caches must not store it.
+    resp.headers['Cache-Control'] = 'private, max-age=300'
+    return ensure_csrf_cookie(resp.make_conditional(request))
 
 @app.route('/')
 def index():
-    html_path = os.path.join(os.path.dirname(__file__), 'index.html')
-    return ensure_csrf_cookie(send_file(html_path))
+    return _index_response()
 
 @app.route('/tutor')
 def tutor_main():
-    html_path = os.path.join(os.path.dirname(__file__), 'index.html')
-    return ensure_csrf_cookie(send_file(html_path))
+    return _index_response()
 
 @app.route('/api/csrf', methods=['GET'])
 def csrf_token():
@@ -79,6 +239,94 @@ def csrf_token():
     resp = jsonify({"token": token})
     return ensure_csrf_cookie(resp, token=token)
 
+class OpenAIFormatError(Exception):
+    """Raised when OpenAI answers but the content is not in the expected shape."""
+
+def _normalize_key(text):
+    return text.strip().lower()
+
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
+# Common spellings of the same career share one cache entry (and one OpenAI call).
+CAREER_ALIASES = {
+    "swe": "software engineer",
+    "sde": "software engineer",
+    "software developer": "software engineer",
+    "software dev": "software engineer",
+    "programmer": "software engineer",
+    "ml engineer": "machine learning engineer",
+    "mle": "machine learning engineer",
+    "ux designer": "user experience designer",
+    "qa engineer": "quality assurance engineer",
+    "devops": "devops engineer",
+    "sre": "site reliability engineer",
+}
+
+def _career_key(coach):
+    """Canonical career name. It is both the cache key and the text sent to OpenAI, so
+    two inputs only share a cached answer if they produce the same prompt."""
+    key = " ".join(_normalize_key(coach).split())
+    return CAREER_ALIASES.get(key, key)
+
+INFLIGHT = {}
+INFLIGHT_LOCK = threading.Lock()
+# Followers wait as long as the leader's slowest possible OpenAI call: every attempt
+# using its full connect + read timeout, plus the retry backoff sleeps.
+INFLIGHT_TIMEOUT = (OPENAI_RETRIES + 1) * sum(OPENAI_TIMEOUT) + OPENAI_BACKOFF * (2 ** OPENAI_RETRIES - 1)
+
+def _single_flight(key, fn, *args):
+    """Run fn(*args) once per key; concurrent callers with the same key wait for that result."""
+    with INFLIGHT_LOCK:
+        future = INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = INFLIGHT[key] = Future()
+    if not leader:
+        return future.result(timeout=INFLIGHT_TIMEOUT)
+    try:
+        result = fn(*args)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with INFLIGHT_LOCK:
+            del INFLIGHT[key]
+
+def _cache_epoch():
+    # Passed into cached helpers so entries roll over every CACHE_TTL_SECONDS.
+    return int(time.time() // CACHE_TTL_SECONDS)
+
+@functools.lru_cache(maxsize=4096)
+def _areas_for(coach, epoch):
+    prompt = [
+        {"role": "system", "content": AREAS_SYSTEM_TMPL.format(coach=coach)},
+        {"role": "user", "content": AREAS_USER_TMPL.format(coach=coach)}
+    ]
+    payload = {**BASE_PAYLOAD, "messages": prompt, "max_tokens": 300}
+    resp = _openai_post(payload)
+    content = orjson.loads(resp.content)["choices"][0]["message"]["content"]
+    logger.info("OpenAI /api/areas response: status=%s bytes=%d", resp.status_code, len(resp.content))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("OpenAI /api/areas content: %s", content)
+    try:
+        areas = orjson.loads(content)
+        if isinstance(areas, list):
+            return areas
+    except Exception as e:
+        logger.warning(f"Direct JSON parse failed: {e}")
+        match = _ARRAY_RE.search(content)
+        if match:
+            try:
+                areas = orjson.loads(match.group(0))
+                if isinstance(areas, list):
+                    return areas
+            except Exception as e2:
+                logger.error(f"Fallback array parse failed: {e2}")
+    # Raising keeps unparseable responses out of the cache.
+    raise OpenAIFormatError("Failed to extract areas from OpenAI response.")
+
 @app.route('/api/areas', methods=['POST'])
 @limiter.limit("5 per minute")  
 def get_areas():
@@ -87,58 +335,55 @@ def get_areas():
     if not OPENAI_API_KEY:
         return jsonify({"error": "API key missing"}), 500
     data = request.get_json()
-    coach = data.get("coach", "").strip()
+    coach = _career_key(data.get("coach", ""))
     if not coach:
         return jsonify({"areas": []})
-    prompt = [
-        {"role": "system", "content": (
-            f"You are an expert career coach. "
-            f"List ONLY the main interview/practice areas for the career: '{coach}'. "
-            "Return a valid JSON array with 10 to 30 distinct strings covering the breadth of the role. "
-            "No commentary, no explanation, no markdown, no keys, no extra text."
-        )},
-        {"role": "user", "content": (
-            f"Provide 10-30 core interview/practice areas for a '{coach}' candidate. "
-            "Output ONLY a JSON array of strings."
-        )}
-    ]
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": OPENAI_MODEL, 
-        "messages": prompt,
-        "max_tokens": 300,
-        "temperature": 0.0 
-    }
     try:
-        resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-        content = resp.json()["choices"][0]["message"]["content"]
-        logger.info(f"OpenAI /api/areas response: {content}")
-        import json
-        try:
-            areas = json.loads(content)
-            if isinstance(areas, list):
-                return jsonify({"areas": areas})
-        except Exception as e:
-            logger.warning(f"Direct JSON parse failed: {e}")
-            start = content.find("[")
-            end = content.find("]", start)
-            if start >= 0 and end > start:
-                arr = content[start:end+1]
-                try:
-                    areas = json.loads(arr)
-                    if isinstance(areas, list):
-                        return jsonify({"areas": areas})
-                except Exception as e2:
-                    logger.error(f"Fallback array parse failed: {e2}")
-        logger.error("Failed to extract areas from OpenAI response.")
+        return jsonify({"areas": _single_flight(("areas", coach), _areas_for, coach, _cache_epoch())})
+    except OpenAIFormatError as e:
+        logger.error(str(e))
         return jsonify({"areas": []})
+    except CircuitBreakerOpen:
+        return jsonify({"error": "OpenAI is temporarily unavailable"}), 503
+    except (FutureTimeout, requests.exceptions.Timeout):
+        return jsonify({"error": "Timed out waiting for OpenAI"}), 504
     except Exception as e:
         logger.error(f"Exception in /api/areas: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Context window per model; OPENAI_CONTEXT_TOKENS overrides it for models not listed here.
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+MAX_CHAT_TOKENS = int(os.getenv("OPENAI_CONTEXT_TOKENS", MODEL_CONTEXT_TOKENS.get(OPENAI_MODEL, 16385)))
+
+class ChatMessage(BaseModel):
+    role: Literal["system", "user", "assistant"]
+    content: str = Field(min_length=1)
+
+class ChatIn(BaseModel):
+    messages: List[ChatMessage] = Field(min_length=1, max_length=20)
+    max_tokens: int = Field(default=800, ge=1, le=1000)
+    temperature: float = Field(default=0.2, ge=0.0, le=2.0)
+    stream: bool = False
+
+    @model_validator(mode='after')
+    def _fits_context(self):
+        # Rough estimate (~4 characters per token) that only rejects clearly oversized input.
+        prompt_tokens = sum(len(m.content) for m in self.messages) // 4
+        if prompt_tokens + self.max_tokens > MAX_CHAT_TOKENS:
+            raise ValueError("messages are too long for the model context")
+        return self
+
+def _validation_message(e):
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc']) or 'body'}: {err['msg']}" for err in e.errors()
+    )
+
 @app.route('/api/chat', methods=['POST'])
 @limiter.limit("5 per minute")  
 def chat():
@@ -147,25 +392,56 @@ def chat():
     if not OPENAI_API_KEY:
         return jsonify({"error": "API key missing"}), 500
 
-    data = request.get_json()
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    try:
+        chat_in = ChatIn.model_validate(request.get_json(silent=True))
+    except ValidationError as e:
+        return jsonify({"error": _validation_message(e)}), 400
     payload = {
-        "model": OPENAI_MODEL, 
-        "messages": data.get("messages"),
-        "max_tokens": data.get("max_tokens", 800),
-        "temperature": data.get("temperature", 0.2)
+        **BASE_PAYLOAD,
+        "messages": [m.model_dump() for m in chat_in.messages],
+        "max_tokens": chat_in.max_tokens,
+        "temperature": chat_in.temperature
     }
+    stream = chat_in.stream
+    if stream:
+        payload["stream"] = True
     try:
-        app.logger.debug("OpenAI payload: %s", payload)
-        resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-        app.logger.debug("OpenAI response: %s", resp.text)
-        return jsonify(resp.json())
+        if app.logger.isEnabledFor(logging.DEBUG):
+            app.logger.debug("OpenAI payload: %s", payload)
+        resp = _openai_post(payload, stream=stream)
+        if stream and resp.ok:
+            # Relay OpenAI's server-sent events as they arrive so the page can render tokens early.
+            app.logger.info("OpenAI /api/chat response: status=%s streaming", resp.status_code)
+            return Response(_relay_stream(resp), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+        app.logger.info("OpenAI /api/chat response: status=%s bytes=%d", resp.status_code, len(resp.content))
+        if app.logger.isEnabledFor(logging.DEBUG):
+            app.logger.debug("OpenAI response: %s", resp.text)
+        return Response(resp.content, status=resp.status_code, mimetype='application/json')
+    except CircuitBreakerOpen:
+        return jsonify({"error": "OpenAI is temporarily unavailable"}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@functools.lru_cache(maxsize=4096)
+def _check_area(area, epoch):
+    prompt = [
+        CHECK_AREA_SYSTEM_MESSAGE,
+        {"role": "user", "content": CHECK_AREA_USER_TMPL.format(area=area)}
+    ]
+    payload = {**BASE_PAYLOAD, "messages": prompt, "max_tokens": 60}
+    resp = _openai_post(payload)
+    content = orjson.loads(resp.content)["choices"][0]["message"]["content"]
+    try:
+        result = orjson.loads(content)
+        if isinstance(result, dict) and "safe" in result:
+            return result
+    except Exception as e:
+        logger.error(f"Failed to parse safety check JSON: {e}")
+    raise OpenAIFormatError("Could not verify area safety")
+
 @app.route('/api/check_area', methods=['POST'])
 @limiter.limit("10 per minute")
 def check_area():
@@ -174,55 +450,36 @@ def check_area():
     if not OPENAI_API_KEY:
         return jsonify({"error": "API key missing"}), 500
     data = request.get_json()
-    area = data.get("area", "").strip()
+    area = _normalize_key(data.get("area", ""))
     if not area:
         return jsonify({"safe": False, "reason": "No area provided"})
-    prompt = [
-        {"role": "system", "content": (
-            "You are a strict career safety classifier. "
-            "Only allow mainstream, legal, and ethical career areas suitable for professional coaching. "
-            "If the area is unsafe, illegal, unethical, or inappropriate (e.g., suicide, sex work, criminal activity), respond ONLY with JSON: {\"safe\": false, \"reason\": \"<short reason>\"}. "
-            "If the area is safe and appropriate for coaching, respond ONLY with JSON: {\"safe\": true}. "
-            "No commentary, no extra text, no markdown."
-        )},
-        {"role": "user", "content": f"Is the area '{area}' safe and appropriate for career coaching?"}
-    ]
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": OPENAI_MODEL,
-        "messages": prompt,
-        "max_tokens": 60,
-        "temperature": 0.0
-    }
     try:
-        resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-        content = resp.json()["choices"][0]["message"]["content"]
-        import json
-        try:
-            result = json.loads(content)
-            if isinstance(result, dict) and "safe" in result:
-                return jsonify(result)
-        except Exception as e:
-            logger.error(f"Failed to parse safety check JSON: {e}")
-        return jsonify({"safe": False, "reason": "Could not verify area safety"})
+        return jsonify(_single_flight(("check_area", area), _check_area, area, _cache_epoch()))
+    except OpenAIFormatError as e:
+        return jsonify({"safe": False, "reason": str(e)})
+    except CircuitBreakerOpen:
+        return jsonify({"error": "OpenAI is temporarily unavailable"}), 503
+    except (FutureTimeout, requests.exceptions.Timeout):
+        return jsonify({"error": "Timed out waiting for OpenAI"}), 504
     except Exception as e:
         logger.error(f"Exception in /api/check_area: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/images/<path:filename>')
 def images(filename):
-    return send_from_directory(IMAGES_DIR, filename)
+    return send_from_directory(IMAGES_DIR, filename, max_age=86400)
 
 @app.route('/css/<path:filename>')
 def css(filename):
-    return send_from_directory(CSS_DIR, filename)
+    return send_from_directory(CSS_DIR, filename, max_age=86400)
 
 @app.route('/favicon.ico')
 def favicon():
-    return Response(FAVICON_BYTES, mimetype='image/png')
+    if FAVICON_BYTES is None:
+        return Response(status=404)
+    resp = Response(FAVICON_BYTES, mimetype='image/png')
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
 
 limiter.init_app(app)
 